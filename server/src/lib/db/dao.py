@@ -1,74 +1,96 @@
-import functools
-import asyncio
-import concurrent.futures
-from typing import Callable, Hashable, Optional, Any, Union
+from typing import Callable, Awaitable, Any, Optional, Mapping
 import sqlalchemy
 import sqlalchemy.engine as sqla_engine
-import sqlalchemy.orm as sqla_orm
+import sqlalchemy.ext.asyncio as sqla_asyncio
+import sqlalchemy.pool as sqla_pool
 from . import orm
 
 
 class DAO:
-    AccessFunctionType = Callable[[Union[sqla_orm.Session, sqla_engine.Connection]], Any]
+    AccessFunctionType = Callable[..., Awaitable[Any]]
+
+    # Driver specific defaults for connect_args. asyncpg keeps prepared statements per
+    # connection, the cached module-level statements are prepared only once per connection.
+    DRIVER_CONNECT_ARGS = {
+        "asyncpg": {"prepared_statement_cache_size": 512}
+    }
 
     def __init__(self,
                  url: str,
-                 scoped: bool = True,
-                 scopefunc: Optional[Callable[[], Hashable]] = None) -> None:
+                 pool_size: int = 32,
+                 max_overflow: int = 16,
+                 pool_timeout: float = 30,
+                 pool_recycle: int = 1800,
+                 pool_pre_ping: bool = False,
+                 query_cache_size: int = 1200,
+                 connect_args: Optional[Mapping[str, Any]] = None) -> None:
         """
-        Initializes DAO instance.
+        Initializes DAO instance. Database schema is not created here,
+        call init() from within a running event loop to do it.
 
-        :param url: URL to access database.
-        :param scoped: If True, use scoped session factory.
-        :param scopefunc: Function that will be used by scoped session factory.
+        :param url: URL to access database, must use an async driver
+                    (e.g. mysql+asyncmy://).
+        :param pool_size: Number of connections kept open in the pool.
+        :param max_overflow: Number of connections allowed above pool_size.
+        :param pool_timeout: Seconds to wait for a free connection.
+        :param pool_recycle: Seconds after which a connection is reopened.
+        :param pool_pre_ping: If True, test connections on checkout. It costs a round-trip
+                              per checkout, use ping() periodically instead.
+        :param query_cache_size: Number of compiled statements kept in the engine's cache.
+        :param connect_args: Arguments passed to the driver's connect(), they override
+                             DRIVER_CONNECT_ARGS.
         :return: None.
         """
 
-        self._executor = concurrent.futures.ThreadPoolExecutor()
-        self._engine = sqlalchemy.create_engine(url)
-        session_factory = sqla_orm.sessionmaker(self._engine)
-        if scoped:
-            session_factory = sqla_orm.scoped_session(session_factory, scopefunc=scopefunc)
-        self._session_factory = session_factory
-        self._init_schema()
+        url = sqla_engine.make_url(url)
+        connect_args = {**self.DRIVER_CONNECT_ARGS.get(url.get_driver_name(), {}), **(connect_args or {})}
+        self._engine = sqla_asyncio.create_async_engine(url,
+                                                        poolclass=sqla_pool.AsyncAdaptedQueuePool,
+                                                        pool_size=pool_size,
+                                                        max_overflow=max_overflow,
+                                                        pool_timeout=pool_timeout,
+                                                        pool_recycle=pool_recycle,
+                                                        pool_pre_ping=pool_pre_ping,
+                                                        query_cache_size=query_cache_size,
+                                                        connect_args=connect_args)
+        self._session_factory = sqla_asyncio.async_sessionmaker(self._engine, expire_on_commit=False)
 
-    def _init_schema(self) -> None:
+    async def init(self) -> None:
         """
         Creates all tables if they are not existed.
 
         :return: None.
         """
 
-        orm.create_all(self._engine)
+        async with self._engine.begin() as connection:
+            await connection.run_sync(orm.create_all)
 
-    def _access(self,
-                func: AccessFunctionType,
-                *args,
-                with_session: bool = True,
-                **kw) -> Any:
+    async def ping(self) -> None:
         """
-        Calls func passing a Session or Connection to it.
+        Executes a trivial statement on a pooled connection to keep it alive.
 
-        :param func: Callable to call.
-        :param args: Arguments to pass to func.
-        :param with_session: If True, use Session, otherwise Connection.
-        :param kw: Key-value arguments to pass to func.
-        :return: Any.
+        :return: None.
         """
 
-        if with_session:
-            with self._session_factory() as session:
-                return func(session, *args, **kw)
-        else:
-            with self._engine.connect() as connection:
-                return func(connection, *args, **kw)
+        async with self._engine.connect() as connection:
+            await connection.execute(sqlalchemy.text("SELECT 1"))
+
+    async def close(self) -> None:
+        """
+        Closes all pooled connections.
+
+        :return: None.
+        """
+
+        await self._engine.dispose()
 
     async def access(self, func: AccessFunctionType, *args, with_session: bool = True, **kw) -> Any:
         """
-        Asynchronously accesses Session or Connection to do some actions.
+        Asynchronously accesses AsyncSession or AsyncConnection to do some actions.
+        Every call gets its own session, so concurrent calls never share one.
         For example:
 
-        def func(session, arg1, arg2):
+        async def func(session, arg1, arg2):
             res = None
             # use session, set result to res
             ...
@@ -77,12 +99,16 @@ class DAO:
         dao = DAO(...)
         res = await dao.access(func, 1, 2)
 
-        :param func: Any callable to use Session or Connection
+        :param func: Any async callable to use AsyncSession or AsyncConnection.
         :param args: Arguments.
-        :param with_session: Whether to use Session (True) or Connection (False).
+        :param with_session: Whether to use AsyncSession (True) or AsyncConnection (False).
         :param kw: Key-value arguments.
         :return: Any.
         """
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(self._executor,
-                                          functools.partial(self._access, func, *args, with_session=with_session, **kw))
+
+        if with_session:
+            async with self._session_factory() as session:
+                return await func(session, *args, **kw)
+        else:
+            async with self._engine.connect() as connection:
+                return await func(connection, *args, **kw)
@@ -1,18 +1,21 @@
 import sqlalchemy.engine as sqla_engine
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
 
 _Base = declarative_base()
 
+# Relationships are never loaded implicitly: AsyncSession can't lazy-load, so
+# callers must request related objects explicitly (selectinload, joinedload, ...).
+
 
 class User(_Base):
     __tablename__ = "User"
 
     id = Column(Integer, primary_key=True)
     name = Column(String(255), nullable=False)
-    group_chats = relationship("GroupChatMembers", backref="user")
+    group_chats = relationship("GroupChatMembers", back_populates="user", lazy="raise")
 
 
 class GroupChat(_Base):
@@ -20,25 +23,30 @@ class GroupChat(_Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(255), nullable=False)
-    members = relationship("GroupChatMembers", backref="group_chat")
+    members = relationship("GroupChatMembers", back_populates="group_chat", lazy="raise")
 
 
 class P2PMessage(_Base):
     __tablename__ = "P2PMessage"
+    # also serves lookups by origin_user_id alone
+    __table_args__ = (Index("ix_p2p_origin_target", "origin_user_id", "target_user_id"),)
 
     id = Column(Integer, primary_key=True)
     message = Column(Text())
     origin_user_id = Column(Integer, ForeignKey(User.id, ondelete="CASCADE"))
-    target_user_id = Column(Integer, ForeignKey(User.id, ondelete="CASCADE"))
+    target_user_id = Column(Integer, ForeignKey(User.id, ondelete="CASCADE"), index=True)
 
 
 class GroupChatMembers(_Base):
     __tablename__ = "GroupChatMembers"
+    # unique index also serves lookups by user_id alone
+    __table_args__ = (UniqueConstraint("user_id", "group_chat_id", name="uq_member"),)
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey(User.id))
-    group_chat_id = Column(Integer, ForeignKey(GroupChat.id))
-    UniqueConstraint(user_id, group_chat_id)
+    group_chat_id = Column(Integer, ForeignKey(GroupChat.id), index=True)
+    user = relationship(User, back_populates="group_chats", lazy="raise")
+    group_chat = relationship(GroupChat, back_populates="members", lazy="raise")
 
 
 class GroupChatMessage(_Base):
@@ -46,14 +54,14 @@ class GroupChatMessage(_Base):
 
     id = Column(Integer, primary_key=True)
     message = Column(Text())
-    group_chat_member_id = Column(Integer, ForeignKey(GroupChatMembers.id, ondelete="CASCADE"))
+    group_chat_member_id = Column(Integer, ForeignKey(GroupChatMembers.id, ondelete="CASCADE"), index=True)
 
 
-def create_all(engine: sqla_engine.Engine) -> None:
+def create_all(connection: sqla_engine.Connection) -> None:
     """
     Creates all tables.
 
-    :param engine: Engine to use for creation.
+    :param connection: Connection to use for creation.
     :return: None.
     """
-    _Base.metadata.create_all(engine)
+    _Base.metadata.create_all(connection)
@@ -1,16 +1,109 @@
-import json
+import asyncio
 import contextlib
+import functools
+import logging
+import cachetools
+import orjson
+import redis.asyncio
+import redis.asyncio.retry
+import redis.backoff
+import redis.exceptions
 import aiohttp.web as aw
-from typing import Mapping, Any, Sequence, Optional, Union, Tuple
+from typing import Mapping, Any, Sequence, Optional, Union, Tuple, Callable, Awaitable
 import sqlalchemy
+import sqlalchemy.ext.asyncio as sqla_asyncio
 import sqlalchemy.orm as sqla_orm
 import sqlalchemy.exc
 from .db import dao
 from .db import orm
 
+_logger = logging.getLogger(__name__)
+
+# Message selects are built once, only "uid" is bound per call.
+# Both return (message id, message) rows of the user or group chat joined to its messages,
+# so a missing user or group chat gives no rows and one without messages gives a single
+# row with NULL message id.
+_P2P_MESSAGES_STMT = sqlalchemy.lambda_stmt(
+    lambda: sqlalchemy.select(orm.P2PMessage.id, orm.P2PMessage.message).select_from(orm.User).outerjoin(
+        orm.P2PMessage, orm.P2PMessage.origin_user_id == orm.User.id
+    ).where(
+        orm.User.id == sqlalchemy.bindparam("uid")
+    )
+)
+_GROUP_CHAT_MESSAGES_STMT = sqlalchemy.lambda_stmt(
+    lambda: sqlalchemy.select(orm.GroupChatMessage.id, orm.GroupChatMessage.message).select_from(
+        orm.GroupChat
+    ).outerjoin(
+        sqlalchemy.join(orm.GroupChatMembers, orm.GroupChatMessage),
+        orm.GroupChatMembers.group_chat_id == orm.GroupChat.id
+    ).where(
+        orm.GroupChat.id == sqlalchemy.bindparam("uid")
+    )
+)
+# Number of messages fetched from the database and written to the response at once.
+_MESSAGES_CHUNK_SIZE = 1000
+# Longer message lists are streamed but not cached.
+_MAX_CACHED_MESSAGES = 1000
+# Total size in bytes of response bodies kept in the in-process cache.
+_LOCAL_CACHE_SIZE = 64 * 1024 * 1024
+# Redis versions of messages cache keys outlive cached bodies by this factor, an expired
+# version restarts from 0 when all bodies stored at older versions have expired already.
+_VERSION_TTL_FACTOR = 10
+
+# Pre-encoded common response bodies, same bytes orjson.dumps gives for the dicts.
+_ERROR_BODY_TEMPLATE = b'{"status":false,"error":%b}'
+_EMPTY_SUCCESS_BODY = b'{"status":true,"data":null}'
+
+_REQUIRED = object()
+
+
+def _typed_query(**params: Union[Callable[[str], Any], Tuple[Callable[[str], Any], Any]]) -> Callable:
+    """
+    Makes a request handler method receive converted query parameters as key-value arguments.
+    For example:
+
+    @_typed_query(id=int, group=(int, 0))
+    async def handler(self, request, id, group):
+        ...
+
+    :param params: Query parameter name to converter (required parameter) or
+                   to (converter, default) pair (optional parameter).
+    :return: Decorator.
+    :raises:
+        aw.HTTPBadRequest: From the decorated handler if a required parameter is missing
+                           or a converter raises ValueError.
+    """
+
+    specs = tuple((name, spec) if isinstance(spec, tuple) else (name, (spec, _REQUIRED))
+                  for name, spec in params.items())
+
+    def decorator(handler: Callable[..., Awaitable[aw.StreamResponse]]) -> Callable:
+        @functools.wraps(handler)
+        async def wrapper(self, request: aw.Request) -> aw.StreamResponse:
+            # request.query (parsed by yarl) is faster than scanning raw_query_string with a regex
+            query, kw = request.query, {}
+            for name, (convert, default) in specs:
+                value = query.get(name)
+                if value is None:
+                    if default is _REQUIRED:
+                        raise aw.HTTPBadRequest(text=f"Missing '{name}'")
+                    kw[name] = default
+                    continue
+                try:
+                    kw[name] = convert(value)
+                except ValueError:
+                    raise aw.HTTPBadRequest(text=f"Bad '{name}': {value}")
+            return await handler(self, request, **kw)
+
+        return wrapper
+
+    return decorator
+
 
 class Server:
     CommonResponseType = Tuple[bool, Union[str, Any]]
+    # local version and Redis version (None if unknown) of a messages cache key
+    CacheVersionType = Tuple[int, Optional[bytes]]
 
     def __init__(self, cfg: Mapping[str, Any]) -> None:
         """
@@ -23,10 +116,15 @@ class Server:
         self._app = None
         self._app_runner = None
         self._app_site = None
+        self._keepalive_task = None
         self._engine = None
         self._session_factory = None
         self._started = False
+        self._msg_cache = None
+        self._msg_versions = {}
+        self._redis = None
         self._init_app()
+        self._init_cache()
         self._init_database_accessor()
         self._init_routes()
 
@@ -38,15 +136,175 @@ class Server:
         """
         self._app = aw.Application()
 
+    def _init_cache(self) -> None:
+        """
+        Creates caches of GET /v1/messages response bodies: in-process TTL cache and,
+        if "cache.url" is configured, Redis shared between server instances.
+
+        :return: None.
+        """
+
+        # the size is counted in bytes of cached bodies
+        self._msg_cache = cachetools.TTLCache(maxsize=_LOCAL_CACHE_SIZE, ttl=1.0, getsizeof=len)
+        url = self._cfg.get("cache.url")
+        if url:
+            # every request waits for Redis, so a stalled Redis must fail fast as a cache miss
+            timeout = self._cfg.get("cache.timeout") or 0.1
+            self._redis = redis.asyncio.from_url(url,
+                                                 socket_timeout=timeout,
+                                                 socket_connect_timeout=timeout,
+                                                 retry=redis.asyncio.retry.Retry(redis.backoff.NoBackoff(), 0))
+
+    @staticmethod
+    def _messages_cache_key(uid: int, is_group: bool) -> str:
+        """
+        Constructs cache key of messages of the specified user or group chat.
+
+        :param uid: User or group chat id.
+        :param is_group: If True, uid is a group chat id.
+        :return: Cache key.
+        """
+        return f"msgs:{'g' if is_group else 'u'}:{uid}"
+
+    @staticmethod
+    def _messages_version_key(key: str) -> str:
+        """
+        Constructs Redis key of the version of the messages cache key.
+
+        :param key: Messages cache key.
+        :return: Version key.
+        """
+        return key + ":v"
+
+    async def _get_cached_messages(self, key: str) -> Tuple[Optional[bytes], Optional[CacheVersionType]]:
+        """
+        Gets cached response body. On a miss returns the current version of the key,
+        which must be passed to _cache_messages() to cache a body queried after this call,
+        and _release_messages_version() must be called once the body is queried.
+        Redis errors are treated as a cache miss.
+
+        :param key: Cache key.
+        :return: Response body and None or None and version of the key if it's not cached.
+        """
+
+        body = self._msg_cache.get(key)
+        if body is not None:
+            return body, None
+        # versions are kept only while there are reads in flight, nothing to invalidate otherwise
+        entry = self._msg_versions.setdefault(key, [0, 0])
+        entry[1] += 1
+        version, redis_version = entry[0], None
+        if self._redis is not None:
+            try:
+                cached, redis_version = await self._redis.mget(key, self._messages_version_key(key))
+            except redis.exceptions.RedisError as e:
+                _logger.warning("Failed to get %s from Redis: %s", key, e)
+            else:
+                # bodies are stored prefixed with the version they have been queried at
+                redis_version = redis_version or b"0"
+                prefix = redis_version + b":"
+                if cached is not None and cached.startswith(prefix):
+                    body = cached[len(prefix):]
+                    if entry[0] == version:
+                        self._cache_messages_locally(key, body)
+                    self._release_messages_version(key)
+                    return body, None
+        return None, (version, redis_version)
+
+    def _release_messages_version(self, key: str) -> None:
+        """
+        Releases version of the key got by _get_cached_messages().
+
+        :param key: Cache key.
+        :return: None.
+        """
+
+        entry = self._msg_versions[key]
+        entry[1] -= 1
+        if not entry[1]:
+            del self._msg_versions[key]
+
+    def _cache_messages_locally(self, key: str, body: bytes) -> None:
+        """
+        Caches response body in the in-process cache unless it's larger than the whole cache.
+
+        :param key: Cache key.
+        :param body: Response body.
+        :return: None.
+        """
+
+        if len(body) <= self._msg_cache.maxsize:
+            self._msg_cache[key] = body
+
+    async def _cache_messages(self, key: str, body: bytes, version: CacheVersionType) -> None:
+        """
+        Caches response body unless the key has been invalidated since its version
+        was got. Redis errors are logged and ignored.
+
+        :param key: Cache key.
+        :param body: Response body.
+        :param version: Version of the key got by _get_cached_messages() before querying the body.
+        :return: None.
+        """
+
+        local_version, redis_version = version
+        if self._msg_versions[key][0] != local_version:
+            return
+        self._cache_messages_locally(key, body)
+        if redis_version is not None:
+            ttl = self._cfg.get("cache.ttl") or 30
+            try:
+                # a body stored by another instance is replaced, but readers never
+                # take a body stored at an outdated version
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.set(key, redis_version + b":" + body, ex=ttl)
+                    pipe.expire(self._messages_version_key(key), ttl * _VERSION_TTL_FACTOR)
+                    await pipe.execute()
+            except redis.exceptions.RedisError as e:
+                _logger.warning("Failed to set %s in Redis: %s", key, e)
+
+    async def _invalidate_messages(self, *keys: str) -> None:
+        """
+        Drops cached response bodies and bumps versions of the keys so that bodies
+        queried before are not cached. Redis errors are logged and ignored.
+
+        :param keys: Cache keys.
+        :return: None.
+        """
+
+        for key in keys:
+            entry = self._msg_versions.get(key)
+            if entry is not None:
+                entry[0] += 1
+            self._msg_cache.pop(key, None)
+        if self._redis is not None:
+            ttl = self._cfg.get("cache.ttl") or 30
+            try:
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        version_key = self._messages_version_key(key)
+                        pipe.incr(version_key)
+                        pipe.expire(version_key, ttl * _VERSION_TTL_FACTOR)
+                    await pipe.execute()
+            except redis.exceptions.RedisError as e:
+                _logger.warning("Failed to invalidate %s in Redis: %s", ",".join(keys), e)
+
     def _init_database_accessor(self) -> None:
         """
-        Creates database engine and session factory.
+        Creates database accessor. Schema is created on start().
 
         :return: None.
         """
 
         url = self._cfg.get("db.url")
-        self._dao = dao.DAO(url)
+        dao_cfg = {name: self._cfg[key] for key, name in (("db.pool_size", "pool_size"),
+                                                           ("db.max_overflow", "max_overflow"),
+                                                           ("db.pool_recycle", "pool_recycle"),
+                                                           ("db.pool_pre_ping", "pool_pre_ping"),
+                                                           ("db.query_cache_size", "query_cache_size"),
+                                                           ("db.connect_args", "connect_args"))
+                    if self._cfg.get(key) is not None}
+        self._dao = dao.DAO(url, **dao_cfg)
 
     def _init_routes(self) -> None:
         """
@@ -75,35 +333,84 @@ class Server:
         """
         return status, data if status else error
 
-    async def _get_messages(self, uid: int, is_group: bool) -> CommonResponseType:
+    @staticmethod
+    async def _exists(session: sqla_asyncio.AsyncSession, cls: type, obj_id: int) -> bool:
         """
-        Gets all messages for the specified user or group chat.
+        Checks if an object with the specified id exists without loading it.
 
-        :param uid: User or group chat id.
-        :param is_group: If True, uid is a group chat id.
-        :return: CommonResponseType object.
+        :param session: Session to use.
+        :param cls: ORM class with "id" primary key.
+        :param obj_id: Object id.
+        :return: True if the object exists.
         """
+        return (await session.execute(sqlalchemy.select(sqlalchemy.literal(True)).where(
+            cls.id == obj_id
+        ))).scalar() is not None
 
-        def do(session: sqla_orm.Session) -> Optional[Sequence[str]]:
-            # 1. Check if user or group chat exists.
-            # 2. Query messages.
-            cls, cond = (orm.User, orm.User.id == uid) if not is_group else (orm.GroupChat, orm.GroupChat.id == uid)
-            obj = session.query(cls).filter(cond).first()
-            if obj is not None:
-                if not is_group:
-                    res = session.query(orm.P2PMessage.message).filter(orm.P2PMessage.origin_user_id == uid).all()
-                else:
-                    res = session.query(orm.GroupChatMessage.message).join(orm.GroupChatMembers).filter(
-                        orm.GroupChatMembers.group_chat_id == uid
-                    ).all()
-                res = tuple(t[0] for t in res)
-            else:
-                res = None
-            return res
+    async def _get_messages(self, request: aw.Request, uid: int, is_group: bool) -> aw.StreamResponse:
+        """
+        Gets all messages for the specified user or group chat. Messages are read
+        and sent once the database connection is released, too many to cache are
+        written to the response as they are fetched from the database.
+
+        :param request: Received request.
+        :param uid: User or group chat id.
+        :param is_group: If True, uid is a group chat id.
+        :return: Response, prepared and finished if messages are streamed.
+        """
+
+        key = self._messages_cache_key(uid, is_group)
+        body, version = await self._get_cached_messages(key)
+        if body is not None:
+            return aw.Response(body=body, content_type="application/json")
+
+        async def do(connection: sqla_asyncio.AsyncConnection) -> Tuple[Optional[aw.StreamResponse], list]:
+            # 1. Query messages, no rows means user or group chat doesn't exist.
+            # 2. Read messages while there are not too many to cache, they are sent
+            #    after the connection is released.
+            # 3. Otherwise stream them holding the connection.
+            stmt = _GROUP_CHAT_MESSAGES_STMT if is_group else _P2P_MESSAGES_STMT
+            result = await connection.stream(stmt, {"uid": uid},
+                                             execution_options={"yield_per": _MESSAGES_CHUNK_SIZE})
+            partitions = result.partitions()
+            chunk = await anext(partitions, None)
+            if chunk is None:
+                return self._response4common(self._construct_common_response(
+                    False, None, f"Identifier {uid} does not exist"
+                )), []
+            if chunk[0][0] is None:
+                # user or group chat without messages
+                chunk = None
+
+            messages = []
+            while chunk is not None and len(messages) <= _MAX_CACHED_MESSAGES:
+                messages.extend(row[1] for row in chunk)
+                chunk = await anext(partitions, None)
+            if chunk is None:
+                return None, messages
+
+            response = aw.StreamResponse(headers={"Content-Type": "application/json"})
+            await response.prepare(request)
+            # encode the whole chunk at once and drop the list brackets
+            await response.write(b'{"status":true,"data":[' + orjson.dumps(messages)[1:-1])
+            while chunk is not None:
+                await response.write(b"," + orjson.dumps([row[1] for row in chunk])[1:-1])
+                chunk = await anext(partitions, None)
+            await response.write(b"]}")
+            await response.write_eof()
+            return response, []
 
-        messages = await self._dao.access(do)
-        return self._construct_common_response(messages is not None, messages,
-                                               "Identifier " + str(uid) + " does not exist")
+        try:
+            # read only Core statements, no need in Session
+            response, messages = await self._dao.access(do, with_session=False)
+            if response is None:
+                # the connection is released already, skipped if messages have changed meanwhile
+                body = orjson.dumps({"status": True, "data": messages})
+                await self._cache_messages(key, body, version)
+                response = aw.Response(body=body, content_type="application/json")
+        finally:
+            self._release_messages_version(key)
+        return response
 
     async def _post_messages(self,
                              message: str,
@@ -120,54 +427,51 @@ class Server:
         :return: CommonResponseType object.
         """
 
-        def do(session: sqla_orm.Session) -> Optional[str]:
-            # 1. Check if user exists.
+        async def do(session: sqla_asyncio.AsyncSession) -> Optional[str]:
+            # 1. Check if user and target user or group chat exist (single query).
             # 2. If target_is_group_chat is False:
-            #    - Check if target user exists.
             #    - Post the message to target user.
             # 3. If target_is_group_chat is True:
-            #    - Check if target group chat exists.
-            #    - Check if user is a member of this chat.
-            #    - Post the message to target group chat.
-            res, msg, invalid_id = None, None, None
-            user = session.query(orm.User).filter(orm.User.id == user_id).first()
-            if user is not None:
-                if not target_is_group_chat:
-                    target_user = session.query(orm.User).filter(orm.User.id == target_id).first()
-                    if target_user is not None:
-                        msg = orm.P2PMessage(message=message,
-                                             origin_user_id=user_id,
-                                             target_user_id=target_id)
-                    else:
-                        invalid_id = target_id
-                else:
-                    chat = session.query(orm.GroupChat).filter(orm.GroupChat.id == target_id).first()
-                    if chat is not None:
-                        member = session.query(orm.GroupChatMembers).filter(sqlalchemy.and_(
+            #    - Post the message to target group chat if user is a member of this chat
+            #      (checked by the INSERT ... SELECT itself).
+            res = None
+            sender = sqla_orm.aliased(orm.User)
+            target = orm.GroupChat if target_is_group_chat else sqla_orm.aliased(orm.User)
+            found = (await session.execute(sqlalchemy.select(sender.id, target.id).select_from(sender).outerjoin(
+                target, target.id == target_id
+            ).where(
+                sender.id == user_id
+            ))).first()
+            if found is None:
+                res = f"Identifier {user_id} does not exist"
+            elif found[1] is None:
+                res = f"Identifier {target_id} does not exist"
+            elif not target_is_group_chat:
+                await session.execute(sqlalchemy.insert(orm.P2PMessage).values(message=message,
+                                                                                origin_user_id=user_id,
+                                                                                target_user_id=target_id))
+                await session.commit()
+            else:
+                ins = sqlalchemy.insert(orm.GroupChatMessage).from_select(
+                    ["message", "group_chat_member_id"],
+                    sqlalchemy.select(sqlalchemy.literal(message), orm.GroupChatMembers.id).where(
+                        sqlalchemy.and_(
                             orm.GroupChatMembers.user_id == user_id,
                             orm.GroupChatMembers.group_chat_id == target_id
-                        )).first()
-                        if member is not None:
-                            msg = orm.GroupChatMessage(message=message,
-                                                       group_chat_member_id=member.id)
-                        else:
-                            res = "User " + str(user_id) + " is not a member of chat " + str(target_id)
-                    else:
-                        invalid_id = target_id
-            else:
-                invalid_id = user_id
-
-            if msg is not None:
-                session.add(msg)
-                session.commit()
-            elif res:
-                pass
-            else:
-                res = "Identifier " + str(invalid_id) + " does not exist"
-
+                        )
+                    )
+                )
+                if (await session.execute(ins)).rowcount == 0:
+                    res = f"User {user_id} is not a member of chat {target_id}"
+                else:
+                    await session.commit()
             return res
 
         error = await self._dao.access(do)
+        if error is None:
+            # P2P messages are listed for the sender, group chat messages for the chat
+            await self._invalidate_messages(self._messages_cache_key(target_id, True) if target_is_group_chat
+                                            else self._messages_cache_key(user_id, False))
         return self._construct_common_response(error is None, None, error)
 
     async def _create_group_char(self, name: str) -> CommonResponseType:
@@ -178,10 +482,10 @@ class Server:
         :return: CommonResponseType object.
         """
 
-        def do(session: sqla_orm.Session) -> int:
+        async def do(session: sqla_asyncio.AsyncSession) -> int:
             chat = orm.GroupChat(name=name)
             session.add(chat)
-            session.commit()
+            await session.commit()
             return chat.id
 
         res = await self._dao.access(do)
@@ -195,10 +499,10 @@ class Server:
         :return: CommonResponseType object.
         """
 
-        def do(session: sqla_orm.Session) -> int:
+        async def do(session: sqla_asyncio.AsyncSession) -> int:
             chat = orm.User(name=name)
             session.add(chat)
-            session.commit()
+            await session.commit()
             return chat.id
 
         res = await self._dao.access(do)
@@ -215,37 +519,42 @@ class Server:
         :return: CommonResponseType object.
         """
 
-        def do(session: sqla_orm.Session) -> Union[str, Sequence[int]]:
-            # 1. Check if group chat exists.
-            # 2. Get list of all users.
-            # 3. Find unknown users and users which are already in the chat.
-            # 4. Add specified users except unknown and that are already in the chat.
-            chat = session.query(orm.GroupChat).filter(orm.GroupChat.id == group_chat_id).first()
-            if chat is not None:
-                all_users = set(t[0] for t in session.query(orm.User.id).all())
+        async def do(session: sqla_asyncio.AsyncSession) -> Union[str, Sequence[int]]:
+            # 1. Query group chat joined to specified users and their membership in the chat,
+            #    no rows means group chat doesn't exist.
+            # 2. Find unknown users and users which are already in the chat.
+            # 3. Add specified users except unknown and that are already in the chat.
+            rows = (await session.execute(sqlalchemy.select(orm.User.id, orm.GroupChatMembers.id).select_from(
+                orm.GroupChat
+            ).outerjoin(
+                orm.User, orm.User.id.in_(users)
+            ).outerjoin(
+                orm.GroupChatMembers, sqlalchemy.and_(orm.GroupChatMembers.user_id == orm.User.id,
+                                                      orm.GroupChatMembers.group_chat_id == orm.GroupChat.id)
+            ).where(
+                orm.GroupChat.id == group_chat_id
+            ))).all()
+            if rows:
+                known_users = {user_id: member_id for user_id, member_id in rows if user_id is not None}
                 add_users = set(users)
-                unknown_users = add_users - all_users
+                unknown_users = add_users - known_users.keys()
                 if unknown_users and all_or_nothing:
-                    res = "Unknown identifiers [" + ",".join(map(str, unknown_users)) + "]"
+                    res = f"Unknown identifiers [{','.join([str(u) for u in unknown_users])}]"
                 else:
                     add_users = add_users - unknown_users
-                    ex_users = set(t[0] for t in session.query(orm.User.id).join(orm.GroupChatMembers).filter(
-                        sqlalchemy.and_(
-                            orm.User.id.in_(add_users),
-                            orm.GroupChatMembers.group_chat_id == group_chat_id
-                        )
-                    ).all())
+                    ex_users = set(user_id for user_id, member_id in known_users.items() if member_id is not None)
                     if ex_users and all_or_nothing:
-                        res = "Users [" + ",".join(map(str, ex_users)) + "] are in chat " + str(group_chat_id)
+                        res = f"Users [{','.join([str(u) for u in ex_users])}] are in chat {group_chat_id}"
                     else:
                         add_users = add_users - ex_users
-                        for user_id in add_users:
-                            session.add(orm.GroupChatMembers(user_id=user_id,
-                                                             group_chat_id=group_chat_id))
-                        session.commit()
+                        if add_users:
+                            await session.execute(sqlalchemy.insert(orm.GroupChatMembers), [
+                                {"user_id": user_id, "group_chat_id": group_chat_id} for user_id in add_users
+                            ])
+                            await session.commit()
                         res = tuple(add_users)
             else:
-                res = "Unknown identifier " + str(group_chat_id)
+                res = f"Unknown identifier {group_chat_id}"
             return res
 
         error_or_res = await self._dao.access(do)
@@ -260,32 +569,37 @@ class Server:
         :return: CommonResponseType object.
         """
 
-        def do(session: sqla_orm.Session) -> Optional[str]:
+        async def do(session: sqla_asyncio.AsyncSession) -> Optional[str]:
             # 1. Check if group chat exists.
             # 2. Check if user exists.
             # 3. Check if user is a member of the chat.
             # 4. Deletes user from the chat.
             res = None
-            chat = session.query(orm.GroupChat).filter(orm.GroupChat.id == group_chat_id).first()
-            if chat is not None:
-                user = session.query(orm.User).filter(orm.User.id == user_id).first()
-                if user is not None:
-                    member = session.query(orm.GroupChatMembers).filter(sqlalchemy.and_(
-                        orm.GroupChatMembers.group_chat_id == group_chat_id,
-                        orm.GroupChatMembers.user_id == user_id
-                    )).first()
-                    if member is not None:
-                        session.delete(member)
-                        session.commit()
+            if await self._exists(session, orm.GroupChat, group_chat_id):
+                if await self._exists(session, orm.User, user_id):
+                    member_id = (await session.execute(sqlalchemy.select(orm.GroupChatMembers.id).where(
+                        sqlalchemy.and_(
+                            orm.GroupChatMembers.group_chat_id == group_chat_id,
+                            orm.GroupChatMembers.user_id == user_id
+                        )
+                    ))).scalar()
+                    if member_id is not None:
+                        await session.execute(sqlalchemy.delete(orm.GroupChatMembers).where(
+                            orm.GroupChatMembers.id == member_id
+                        ))
+                        await session.commit()
                     else:
-                        res = "User " + str(user_id) + " is not a member of chat " + str(group_chat_id)
+                        res = f"User {user_id} is not a member of chat {group_chat_id}"
                 else:
-                    res = "Unknown identifier " + str(user_id)
+                    res = f"Unknown identifier {user_id}"
             else:
-                res = "Unknown identifier " + str(group_chat_id)
+                res = f"Unknown identifier {group_chat_id}"
             return res
 
         error = await self._dao.access(do)
+        if error is None:
+            # messages of the removed member are not returned for the chat anymore
+            await self._invalidate_messages(self._messages_cache_key(group_chat_id, True))
         return self._construct_common_response(error is None, None, error)
 
 
@@ -298,10 +612,13 @@ class Server:
         :return: aw.Response object
         """
 
-        return aw.json_response({
-            "status": res[0],
-            "data" if res[0] else "error": res[1]
-        })
+        if not res[0]:
+            body = _ERROR_BODY_TEMPLATE % orjson.dumps(res[1])
+        elif res[1] is None:
+            body = _EMPTY_SUCCESS_BODY
+        else:
+            body = orjson.dumps({"status": True, "data": res[1]})
+        return aw.Response(body=body, content_type="application/json")
 
     @staticmethod
     async def _get_request_body(request: aw.Request, body_is_json: bool = True) -> Union[str, Mapping[str, Any]]:
@@ -317,11 +634,13 @@ class Server:
 
         if not request.body_exists:
             raise aw.HTTPBadRequest(text="No body")
-        body = await request.text()
+        if not body_is_json:
+            return await request.text()
+        body = await request.read()
         try:
-            data = json.loads(body) if body_is_json else body
-        except ValueError:
-            raise aw.HTTPBadRequest(text="Bad body: " + body)
+            data = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            raise aw.HTTPBadRequest(text=f"Bad body: {body.decode(errors='replace')}")
         return data
 
     async def _req_h_post_del_from_group_chat(self, request: aw.Request) -> aw.Response:
@@ -472,11 +791,11 @@ class Server:
                                         data["targetIsGroupChat"])
         return self._response4common(res)
 
-    async def _req_h_get_messages(self, request: aw.Request) -> aw.Response:
+    @_typed_query(id=int, group=(int, 0))
+    async def _req_h_get_messages(self, request: aw.Request, id: int, group: int) -> aw.StreamResponse:
         """
-        Processes GET request to /v1/messages. For simlicity let's assume
-        the maximum number of messages in the DB is not to big to return
-        them in a single JSON.
+        Processes GET request to /v1/messages. Messages are streamed, so
+        there is no limit on how many of them are returned in a single JSON.
 
         Request query format:
 
@@ -490,27 +809,32 @@ class Server:
             }
 
         :param request: Received request.
+        :param id: User or group chat id, parsed from the query by _typed_query.
+        :param group: Non-zero if id is a group chat id, parsed from the query by _typed_query.
         :return: JSON response with status and data or an error.
         :raises:
             aw.HTTPBadRequest: If something is wong with the request.
         """
 
-        req_id = request.query.get("id")
-        if req_id is None:
-            raise aw.HTTPBadRequest(text="Missing 'id'")
-        try:
-            req_id = int(req_id)
-        except ValueError:
-            raise aw.HTTPBadRequest(text="Bad 'id': " + req_id)
-        req_group = request.query.get("group", "0")
-        try:
-            req_group = bool(int(req_group))
-        except ValueError:
-            raise aw.HTTPBadRequest(text="Bad 'group': " + req_group)
+        return await self._get_messages(request, id, bool(group))
 
-        res = await self._get_messages(req_id, req_group)
+    async def _keepalive(self) -> None:
+        """
+        Periodically pings the database so that idle pooled connections
+        are not dropped by the server.
 
-        return self._response4common(res)
+        :return: None.
+        """
+
+        interval = self._cfg.get("db.keepalive_interval") or 30
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._dao.ping()
+            except (sqlalchemy.exc.SQLAlchemyError, OSError) as e:
+                # broken connection is invalidated by the pool and reopened on next checkout,
+                # exhausted pool means connections are in use anyway
+                _logger.warning("Database keepalive failed: %s", e)
 
     async def start(self) -> bool:
         """
@@ -521,17 +845,21 @@ class Server:
         """
         res = not self._started
         if not self._started:
+            await self._dao.init()
             self._app_runner = aw.AppRunner(self._app)
-            await self._app_runner.setup()
-            with contextlib.ExitStack() as stack:
-                stack.callback(self._app_runner.cleanup)
+            try:
+                await self._app_runner.setup()
                 self._app_site = aw.TCPSite(self._app_runner,
                                             self._cfg.get("location.host"),
                                             self._cfg.get("location.port"),
                                             reuse_address=True)
                 await self._app_site.start()
-                self._started = True
-                stack.pop_all()
+            except BaseException:
+                await self._app_runner.cleanup()
+                await self._dao.close()
+                raise
+            self._started = True
+            self._keepalive_task = asyncio.create_task(self._keepalive())
         return res
 
     async def stop(self) -> None:
@@ -541,7 +869,13 @@ class Server:
         :return: None.
         """
         if self._started:
+            self._keepalive_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await self._keepalive_task
             await self._app_runner.cleanup()
+            await self._dao.close()
+            if self._redis is not None:
+                await self._redis.aclose()
 
     @property
     def started(self) -> bool:
@@ -1,10 +1,28 @@
 import asyncio
 import argparse
+import signal
 import lib.server
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+async def serve(server: lib.server.Server) -> None:
+    await server.start()
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopped.set)
+    try:
+        await stopped.wait()
+    finally:
+        await server.stop()
+
 
 def main(args: argparse.Namespace) -> None:
-    db_url = "mysql+pymysql://"
+    db_url = "mysql+asyncmy://"
     if args.db_user_name and args.db_user_password:
         db_url += args.db_user_name + ":" + args.db_user_password + "@"
     db_url += (args.db_host or "127.0.0.1") + ":"
@@ -13,15 +31,19 @@ def main(args: argparse.Namespace) -> None:
 
     cfg = {
         "db.url": db_url,
+        "db.pool_size": args.db_pool_size,
+        "db.max_overflow": args.db_max_overflow,
+        "db.keepalive_interval": args.db_keepalive_interval,
+        "cache.url": args.cache_url,
+        "cache.ttl": args.cache_ttl,
+        "cache.timeout": args.cache_timeout,
         "location.host": args.host,
         "location.port": args.port
     }
 
-    # for simplicity just start server and that's all, no error handling and so on
+    # for simplicity just run server until SIGINT or SIGTERM, no error handling and so on
     server = lib.server.Server(cfg)
-    loop = asyncio.get_event_loop()
-    asyncio.ensure_future(server.start(), loop=loop)
-    loop.run_forever()
+    (uvloop.run if uvloop is not None else asyncio.run)(serve(server))
 
 
 if __name__ == "__main__":
@@ -40,6 +62,18 @@ if __name__ == "__main__":
                         default=None, help="Database user password")
     parser.add_argument("-d", "--db-name", action="store", dest="db_name", type=str, required=True,
                         help="Database name")
+    parser.add_argument("--db-pool-size", action="store", dest="db_pool_size", type=int, required=False,
+                        default=None, help="Number of pooled database connections")
+    parser.add_argument("--db-max-overflow", action="store", dest="db_max_overflow", type=int, required=False,
+                        default=None, help="Number of database connections allowed above the pool size")
+    parser.add_argument("--db-keepalive-interval", action="store", dest="db_keepalive_interval", type=float,
+                        required=False, default=None, help="Seconds between pings of pooled database connections")
+    parser.add_argument("--cache-url", action="store", dest="cache_url", type=str, required=False,
+                        default=None, help="Redis URL to cache messages in")
+    parser.add_argument("--cache-ttl", action="store", dest="cache_ttl", type=int, required=False,
+                        default=None, help="Seconds messages are kept in Redis")
+    parser.add_argument("--cache-timeout", action="store", dest="cache_timeout", type=float, required=False,
+                        default=None, help="Seconds to wait for Redis before treating it as a cache miss")
     args = parser.parse_args()
 
     main(args)
@@ -0,0 +1,23 @@
+import asyncio
+import unittest
+import lib.db.dao
+
+
+class TestDAOSessions(unittest.TestCase):
+    url = "mysql+asyncmy://localhost/db"
+
+    def test_concurrent_access_uses_distinct_sessions(self) -> None:
+        dao = lib.db.dao.DAO(self.url)
+        sessions = []
+
+        async def func(session):
+            sessions.append(session)
+            await asyncio.sleep(0)
+            return session
+
+        async def run():
+            return await asyncio.gather(dao.access(func), dao.access(func))
+
+        first, second = asyncio.run(run())
+        self.assertIsNot(first, second)
+        self.assertEqual(len(sessions), 2)
@@ -0,0 +1,404 @@
+import asyncio
+import os
+import socket
+import tempfile
+import unittest
+import unittest.mock
+from typing import Tuple
+import aiohttp.test_utils as at
+import fakeredis
+import aiohttp.web as aw
+import sqlalchemy.exc as sqla_exc
+import lib.server
+
+
+class EndpointTestCase(unittest.IsolatedAsyncioTestCase):
+    cfg = {}
+
+    async def asyncSetUp(self) -> None:
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        url = "sqlite+aiosqlite:///" + os.path.join(self._tmp_dir.name, "test.db")
+        self.server = lib.server.Server({"db.url": url, **self.cfg})
+        await self.server._dao.init()
+        self.client = at.TestClient(at.TestServer(self.server._app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self) -> None:
+        await self.client.close()
+        await self.server._dao.close()
+        if self.server._redis is not None:
+            await self.server._redis.aclose()
+        self._tmp_dir.cleanup()
+
+    async def _call(self, method: str, path: str, **kw) -> dict:
+        async with self.client.request(method, path, **kw) as response:
+            self.assertEqual(response.status, 200)
+            return await response.json()
+
+    async def _create(self, what: str, name: str) -> int:
+        res = await self._call("POST", "/v1/" + what, json={"name": name})
+        self.assertTrue(res["status"])
+        return res["data"]
+
+    async def _get_messages(self, uid: int, is_group: bool = False) -> dict:
+        return await self._call("GET", f"/v1/messages?id={uid}&group={int(is_group)}")
+
+    async def _post_message(self, user_id: int, target_id: int, is_group: bool, message: str) -> dict:
+        return await self._call("POST", "/v1/messages", json={"originUserId": user_id,
+                                                               "targetId": target_id,
+                                                               "targetIsGroupChat": is_group,
+                                                               "message": message})
+
+    async def _add_participants(self, group_chat_id: int, users: list, all_or_nothing: bool) -> dict:
+        return await self._call("POST", f"/v1/group_chat/{group_chat_id}/participants",
+                                json={"userId": users, "allOrNothing": all_or_nothing})
+
+    def _post_on_messages_read(self, server: lib.server.Server, message: str, user_id: int, target_id: int):
+        """
+        Patches DAO of the tested server to post a P2P message via the specified server
+        once messages of a GET /v1/messages request have been read from the database.
+        """
+
+        access = self.server._dao.access
+
+        async def access_and_post(func, *args, **kw):
+            res = await access(func, *args, **kw)
+            if not kw.get("with_session", True):
+                await server._post_messages(message, user_id, target_id, False)
+            return res
+
+        return unittest.mock.patch.object(self.server._dao, "access", access_and_post)
+
+
+class TestGetMessages(EndpointTestCase):
+    async def test_unknown_id(self) -> None:
+        self.assertEqual(await self._get_messages(1),
+                         {"status": False, "error": "Identifier 1 does not exist"})
+        self.assertEqual(await self._get_messages(1, True),
+                         {"status": False, "error": "Identifier 1 does not exist"})
+
+    async def test_no_messages(self) -> None:
+        user_id = await self._create("user", "a")
+        chat_id = await self._create("group_chat", "g")
+        self.assertEqual(await self._get_messages(user_id), {"status": True, "data": []})
+        self.assertEqual(await self._get_messages(chat_id, True), {"status": True, "data": []})
+
+    async def test_more_messages_than_chunk(self) -> None:
+        sender = await self._create("user", "a")
+        target = await self._create("user", "b")
+        messages = [f"m{i}" for i in range(7)]
+        for message in messages:
+            await self._post_message(sender, target, False, message)
+        with unittest.mock.patch.object(lib.server, "_MESSAGES_CHUNK_SIZE", 3):
+            res = await self._get_messages(sender)
+        self.assertTrue(res["status"])
+        self.assertCountEqual(res["data"], messages)
+
+    async def _get_messages_checked_out(self, uid: int) -> Tuple[dict, list]:
+        """
+        Gets messages recording number of checked out connections when the response is prepared.
+        """
+
+        checked_out = []
+        prepare = aw.StreamResponse.prepare
+
+        async def prepare_and_record(response, request):
+            checked_out.append(self.server._dao._engine.pool.checkedout())
+            return await prepare(response, request)
+
+        with unittest.mock.patch.object(aw.StreamResponse, "prepare", prepare_and_record):
+            return await self._get_messages(uid), checked_out
+
+    async def test_connection_released_before_response(self) -> None:
+        sender = await self._create("user", "a")
+        target = await self._create("user", "b")
+        await self._post_message(sender, target, False, "x")
+        self.assertEqual(await self._get_messages_checked_out(sender), ({"status": True, "data": ["x"]}, [0]))
+
+    async def test_streams_too_many_to_cache(self) -> None:
+        sender = await self._create("user", "a")
+        target = await self._create("user", "b")
+        messages = [f"m{i}" for i in range(7)]
+        for message in messages:
+            await self._post_message(sender, target, False, message)
+        with unittest.mock.patch.object(lib.server, "_MESSAGES_CHUNK_SIZE", 2), \
+                unittest.mock.patch.object(lib.server, "_MAX_CACHED_MESSAGES", 2):
+            res, checked_out = await self._get_messages_checked_out(sender)
+        self.assertTrue(res["status"])
+        self.assertCountEqual(res["data"], messages)
+        # streamed holding the connection, not cached
+        self.assertEqual(checked_out, [1])
+        self.assertNotIn(self.server._messages_cache_key(sender, False), self.server._msg_cache)
+
+
+class TestPostMessages(EndpointTestCase):
+    async def test_unknown_ids(self) -> None:
+        user_id = await self._create("user", "a")
+        self.assertEqual(await self._post_message(9, user_id, False, "x"),
+                         {"status": False, "error": "Identifier 9 does not exist"})
+        self.assertEqual(await self._post_message(user_id, 9, False, "x"),
+                         {"status": False, "error": "Identifier 9 does not exist"})
+        self.assertEqual(await self._post_message(user_id, 9, True, "x"),
+                         {"status": False, "error": "Identifier 9 does not exist"})
+
+    async def test_p2p(self) -> None:
+        sender = await self._create("user", "a")
+        target = await self._create("user", "b")
+        self.assertEqual(await self._post_message(sender, target, False, "hé\"1"), {"status": True, "data": None})
+        self.assertEqual(await self._get_messages(sender), {"status": True, "data": ["hé\"1"]})
+        self.assertEqual(await self._get_messages(target), {"status": True, "data": []})
+
+    async def test_group_non_member(self) -> None:
+        member = await self._create("user", "a")
+        stranger = await self._create("user", "b")
+        chat_id = await self._create("group_chat", "g")
+        await self._add_participants(chat_id, [member], True)
+        self.assertEqual(await self._post_message(stranger, chat_id, True, "x"),
+                         {"status": False, "error": f"User {stranger} is not a member of chat {chat_id}"})
+        self.assertEqual(await self._post_message(member, chat_id, True, "y"), {"status": True, "data": None})
+        self.assertEqual(await self._get_messages(chat_id, True), {"status": True, "data": ["y"]})
+
+
+class TestGroupChatParticipants(EndpointTestCase):
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+        self.users = [await self._create("user", name) for name in ("a", "b", "c")]
+        self.chat_id = await self._create("group_chat", "g")
+        await self._add_participants(self.chat_id, self.users[:1], True)
+
+    async def test_unknown_group_chat(self) -> None:
+        self.assertEqual(await self._add_participants(9, self.users, False),
+                         {"status": False, "error": "Unknown identifier 9"})
+
+    async def test_all_or_nothing(self) -> None:
+        # unknown users are reported before existing members
+        self.assertEqual(await self._add_participants(self.chat_id, self.users + [9], True),
+                         {"status": False, "error": "Unknown identifiers [9]"})
+        self.assertEqual(await self._add_participants(self.chat_id, self.users, True),
+                         {"status": False, "error": f"Users [{self.users[0]}] are in chat {self.chat_id}"})
+        # nothing has been added
+        self.assertEqual(await self._post_message(self.users[1], self.chat_id, True, "x"),
+                         {"status": False, "error": f"User {self.users[1]} is not a member of chat {self.chat_id}"})
+
+    async def test_partial(self) -> None:
+        res = await self._add_participants(self.chat_id, self.users + [9], False)
+        self.assertTrue(res["status"])
+        self.assertCountEqual(res["data"], self.users[1:])
+        self.assertEqual(await self._add_participants(self.chat_id, self.users, False),
+                         {"status": True, "data": []})
+
+    async def test_delete(self) -> None:
+        user_id, chat_id = self.users[0], self.chat_id
+        self.assertEqual(await self._call("DELETE", f"/v1/group_chat/{chat_id}/participants/{user_id}"),
+                         {"status": True, "data": None})
+        self.assertEqual(await self._call("DELETE", f"/v1/group_chat/{chat_id}/participants/{user_id}"),
+                         {"status": False, "error": f"User {user_id} is not a member of chat {chat_id}"})
+        self.assertEqual(await self._call("DELETE", f"/v1/group_chat/{chat_id}/participants/9"),
+                         {"status": False, "error": "Unknown identifier 9"})
+        self.assertEqual(await self._call("DELETE", f"/v1/group_chat/9/participants/{user_id}"),
+                         {"status": False, "error": "Unknown identifier 9"})
+
+
+class TestMessagesCache(EndpointTestCase):
+    async def test_p2p_post_invalidates(self) -> None:
+        sender = await self._create("user", "a")
+        target = await self._create("user", "b")
+        self.assertEqual(await self._get_messages(sender), {"status": True, "data": []})
+        self.assertIn(self.server._messages_cache_key(sender, False), self.server._msg_cache)
+        await self._post_message(sender, target, False, "x")
+        self.assertEqual(await self._get_messages(sender), {"status": True, "data": ["x"]})
+
+    async def test_group_post_invalidates(self) -> None:
+        user_id = await self._create("user", "a")
+        chat_id = await self._create("group_chat", "g")
+        await self._add_participants(chat_id, [user_id], True)
+        self.assertEqual(await self._get_messages(chat_id, True), {"status": True, "data": []})
+        self.assertIn(self.server._messages_cache_key(chat_id, True), self.server._msg_cache)
+        await self._post_message(user_id, chat_id, True, "x")
+        self.assertEqual(await self._get_messages(chat_id, True), {"status": True, "data": ["x"]})
+
+    async def test_member_removal_invalidates(self) -> None:
+        users = [await self._create("user", name) for name in ("a", "b")]
+        chat_id = await self._create("group_chat", "g")
+        await self._add_participants(chat_id, users, True)
+        await self._post_message(users[0], chat_id, True, "x")
+        await self._post_message(users[1], chat_id, True, "y")
+        self.assertCountEqual((await self._get_messages(chat_id, True))["data"], ["x", "y"])
+        await self._call("DELETE", f"/v1/group_chat/{chat_id}/participants/{users[1]}")
+        self.assertEqual(await self._get_messages(chat_id, True), {"status": True, "data": ["x"]})
+
+    async def test_size_in_bytes(self) -> None:
+        with unittest.mock.patch.object(lib.server, "_LOCAL_CACHE_SIZE", 64):
+            self.server._init_cache()
+        users = [await self._create("user", name) for name in ("a", "b")]
+        await self._post_message(users[0], users[1], False, "x" * 64)
+        self.assertEqual(await self._get_messages(users[0]), {"status": True, "data": ["x" * 64]})
+        self.assertEqual(await self._get_messages(users[1]), {"status": True, "data": []})
+        # the larger body doesn't fit
+        self.assertEqual(list(self.server._msg_cache), [self.server._messages_cache_key(users[1], False)])
+        self.assertEqual(self.server._msg_cache.currsize, len(b'{"status":true,"data":[]}'))
+
+    async def test_post_during_read_is_not_lost(self) -> None:
+        sender = await self._create("user", "a")
+        target = await self._create("user", "b")
+        # committed and invalidated after the read but before its result is cached
+        with self._post_on_messages_read(self.server, "x", sender, target):
+            self.assertEqual(await self._get_messages(sender), {"status": True, "data": []})
+        self.assertEqual(await self._get_messages(sender), {"status": True, "data": ["x"]})
+        # versions are dropped once no read is in flight
+        self.assertEqual(self.server._msg_versions, {})
+
+
+class TestRedisMessagesCache(EndpointTestCase):
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+        redis_server = fakeredis.FakeServer()
+        self.server._redis = fakeredis.FakeAsyncRedis(server=redis_server)
+        # another server instance sharing the database and Redis
+        self.other = lib.server.Server(self.server._cfg)
+        self.other._redis = fakeredis.FakeAsyncRedis(server=redis_server)
+
+    async def asyncTearDown(self) -> None:
+        await self.other._dao.close()
+        await self.other._redis.aclose()
+        await super().asyncTearDown()
+
+    async def _get_messages_from_redis(self, uid: int) -> dict:
+        self.server._msg_cache.clear()
+        return await self._get_messages(uid)
+
+    async def test_post_invalidates(self) -> None:
+        sender = await self._create("user", "a")
+        target = await self._create("user", "b")
+        self.assertEqual(await self._get_messages(sender), {"status": True, "data": []})
+        self.assertEqual(await self._get_messages_from_redis(sender), {"status": True, "data": []})
+        await self.other._post_messages("x", sender, target, False)
+        self.assertEqual(await self._get_messages_from_redis(sender), {"status": True, "data": ["x"]})
+
+    async def test_versions_expire(self) -> None:
+        sender = await self._create("user", "a")
+        target = await self._create("user", "b")
+        version_key = self.server._messages_version_key(self.server._messages_cache_key(sender, False))
+        max_ttl = 30 * lib.server._VERSION_TTL_FACTOR
+        await self._post_message(sender, target, False, "x")
+        self.assertTrue(30 < await self.server._redis.ttl(version_key) <= max_ttl)
+        await self.server._redis.expire(version_key, 1)
+        self.assertEqual(await self._get_messages(sender), {"status": True, "data": ["x"]})
+        # refreshed when a body is stored
+        self.assertTrue(30 < await self.server._redis.ttl(version_key) <= max_ttl)
+
+    async def test_post_during_read_is_not_lost(self) -> None:
+        sender = await self._create("user", "a")
+        target = await self._create("user", "b")
+        with self._post_on_messages_read(self.other, "x", sender, target):
+            self.assertEqual(await self._get_messages(sender), {"status": True, "data": []})
+        self.assertEqual(await self._get_messages_from_redis(sender), {"status": True, "data": ["x"]})
+
+
+class TestUnavailableRedis(EndpointTestCase):
+    # nothing listens on port 1
+    cfg = {"cache.url": "redis://127.0.0.1:1/0"}
+
+    async def test_requests_succeed(self) -> None:
+        sender = await self._create("user", "a")
+        target = await self._create("user", "b")
+        with self.assertLogs(lib.server._logger, "WARNING"):
+            self.assertEqual(await self._get_messages(sender), {"status": True, "data": []})
+            self.assertEqual(await self._post_message(sender, target, False, "x"), {"status": True, "data": None})
+            self.assertEqual(await self._get_messages(sender), {"status": True, "data": ["x"]})
+
+
+class TestStalledRedis(EndpointTestCase):
+    async def asyncSetUp(self) -> None:
+        # accepts connections but never answers
+        self._connections = []
+        self._redis_server = await asyncio.start_server(lambda r, w: self._connections.append(w), "127.0.0.1", 0)
+        port = self._redis_server.sockets[0].getsockname()[1]
+        self.cfg = {"cache.url": f"redis://127.0.0.1:{port}/0", "cache.timeout": 0.05}
+        await super().asyncSetUp()
+
+    async def asyncTearDown(self) -> None:
+        await super().asyncTearDown()
+        for writer in self._connections:
+            writer.close()
+        self._redis_server.close()
+        await self._redis_server.wait_closed()
+
+    async def test_requests_succeed(self) -> None:
+        sender = await self._create("user", "a")
+        target = await self._create("user", "b")
+        with self.assertLogs(lib.server._logger, "WARNING"):
+            self.assertEqual(await asyncio.wait_for(self._get_messages(sender), 1),
+                             {"status": True, "data": []})
+            self.assertEqual(await asyncio.wait_for(self._post_message(sender, target, False, "x"), 1),
+                             {"status": True, "data": None})
+            self.assertEqual(await asyncio.wait_for(self._get_messages(sender), 1),
+                             {"status": True, "data": ["x"]})
+
+
+class TestKeepalive(EndpointTestCase):
+    cfg = {"db.keepalive_interval": 0.01}
+
+    async def test_survives_errors(self) -> None:
+        pings = []
+
+        async def ping():
+            pings.append(None)
+            raise sqla_exc.TimeoutError("pool exhausted")
+
+        with unittest.mock.patch.object(self.server._dao, "ping", ping):
+            task = asyncio.create_task(self.server._keepalive())
+            with self.assertLogs(lib.server._logger, "WARNING"):
+                while len(pings) < 2 and not task.done():
+                    await asyncio.sleep(0.01)
+            self.assertFalse(task.done())
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+    async def test_stop_after_keepalive_failure(self) -> None:
+        async def ping():
+            raise ValueError("unexpected")
+
+        server = lib.server.Server({**self.server._cfg, "location.host": "127.0.0.1", "location.port": 0})
+        close = unittest.mock.AsyncMock(side_effect=server._dao.close)
+        with unittest.mock.patch.object(server._dao, "ping", ping), \
+                unittest.mock.patch.object(server._dao, "close", close):
+            await server.start()
+            # releases the port and the pool if stop() fails
+            self.addAsyncCleanup(server._app_runner.cleanup)
+            self.addAsyncCleanup(server._dao._engine.dispose)
+            while not server._keepalive_task.done():
+                await asyncio.sleep(0.01)
+            await server.stop()
+        close.assert_awaited_once()
+
+
+class TestStart(EndpointTestCase):
+    def _server(self, port: int) -> lib.server.Server:
+        server = lib.server.Server({**self.server._cfg, "location.host": "127.0.0.1", "location.port": port})
+        self.addAsyncCleanup(server._dao._engine.dispose)
+        return server
+
+    async def _assert_start_fails(self, server: lib.server.Server, error: type) -> None:
+        close = unittest.mock.AsyncMock(side_effect=server._dao.close)
+        with unittest.mock.patch.object(server._dao, "close", close):
+            with self.assertRaises(error):
+                await server.start()
+        self.assertFalse(server.started)
+        close.assert_awaited_once()
+        self.assertEqual(server._dao._engine.pool.checkedout(), 0)
+
+    async def test_port_in_use(self) -> None:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            sock.listen()
+            server = self._server(sock.getsockname()[1])
+            await self._assert_start_fails(server, OSError)
+        # runner is cleaned up, so no sites are left
+        self.assertEqual(server._app_runner.sites, set())
+
+    async def test_setup_fails(self) -> None:
+        server = self._server(0)
+        with unittest.mock.patch.object(aw.AppRunner, "setup", side_effect=RuntimeError("setup")):
+            await self._assert_start_fails(server, RuntimeError)
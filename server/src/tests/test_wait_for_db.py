@@ -0,0 +1,49 @@
+import errno
+import socket
+import unittest
+import unittest.mock
+import wait_for_db
+
+
+class TestCheck(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.delays = []
+
+        def sleep(delay):
+            self.delays.append(delay)
+            self.now += delay
+
+        patches = (unittest.mock.patch.object(wait_for_db.time, "time", lambda: self.now),
+                   unittest.mock.patch.object(wait_for_db.time, "sleep", sleep))
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _patch_connect(self, side_effect) -> unittest.mock.MagicMock:
+        patch = unittest.mock.patch.object(wait_for_db.socket, "create_connection", side_effect=side_effect)
+        self.addCleanup(patch.stop)
+        return patch.start()
+
+    def test_refused_retried_with_backoff_until_timeout(self) -> None:
+        connect = self._patch_connect(ConnectionRefusedError(errno.ECONNREFUSED, "refused"))
+        with self.assertRaisesRegex(Exception, "Timeout: 5"):
+            wait_for_db._check("db", 3306, 5)
+        self.assertEqual(self.delays[:6], [0.05, 0.1, 0.2, 0.4, 0.8, 1.0])
+        self.assertTrue(all(delay == 1.0 for delay in self.delays[5:]))
+        # ends within one maximal delay after the timeout without spinning
+        self.assertTrue(5 < self.now <= 6)
+        self.assertEqual(connect.call_count, len(self.delays))
+
+    def test_connect_timeout_retried(self) -> None:
+        connection = unittest.mock.MagicMock()
+        self._patch_connect([socket.timeout(), ConnectionResetError(errno.ECONNRESET, "reset"), connection])
+        wait_for_db._check("db", 3306, 5)
+        self.assertEqual(self.delays, [0.05, 0.1])
+        connection.close.assert_called_once()
+
+    def test_other_errors_raised(self) -> None:
+        self._patch_connect(OSError(errno.EACCES, "denied"))
+        with self.assertRaises(OSError):
+            wait_for_db._check("db", 3306, 5)
+        self.assertEqual(self.delays, [])
@@ -7,19 +7,24 @@ import re
 from typing import Optional
 
 
+_RETRY_ERRNOS = (errno.ECONNREFUSED, errno.ECONNRESET, errno.EHOSTUNREACH)
+
+
 def _check(host: str, port: int, timeout: Optional[int]) -> None:
     start = time.time()
+    delay = 0.05
     while timeout is None or (time.time() - start) <= timeout:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            sock.connect((host, port))
+            socket.create_connection((host, port), timeout=1.0).close()
+        except socket.timeout:
+            pass
         except OSError as exc:
-            if exc.errno == errno.ECONNREFUSED:
-                continue
-            raise
-        finally:
-            sock.close()
-        break
+            if exc.errno not in _RETRY_ERRNOS:
+                raise
+        else:
+            break
+        time.sleep(delay)
+        delay = min(delay * 2, 1.0)
     else:
         raise Exception("Timeout: " + str(timeout))
 